@@ -2,14 +2,112 @@ import tkinter as tk
 from tkinter import messagebox, simpledialog
 from src.profile_manager import ProfileManager
 import socket
+import selectors
 import threading
-import re
+import queue
+import codecs
+from functools import lru_cache
+from itertools import chain
+
+# orjson is optional; it is several times faster on small GMCP payloads
+try:
+    from orjson import loads as json_loads
+except ImportError:
+    from json import JSONDecoder
+
+    _json_decode = JSONDecoder().decode
+
+    def json_loads(body):
+        # json.loads sniffs the encoding of bytes input on every call;
+        # GMCP is always UTF-8. UnicodeDecodeError is a ValueError too.
+        return _json_decode(body.decode('utf-8'))
+
+class _ConnectionState:
+    # Receive state of one connection. It is attached to the socket's
+    # selector key, so a read still in flight for an old socket can only
+    # touch that socket's state, never the next connection's
+    def __init__(self):
+        # Bytes of an unfinished telnet command, and a decoder that holds
+        # back split UTF-8 sequences
+        self.rx_buffer = bytearray()
+        self.skipping_sb = False
+        self.decoder = codecs.getincrementaldecoder('utf-8')(errors='replace')
+        # ANSI parser state: the current color carries over between chunks
+        # until the server resets it, and an escape sequence cut off at the
+        # end of a chunk is kept
+        self.cur_tag = "default"
+        self.ansi_partial = ""
 
 class MUDClientApp:
+    # Foreground colors for the standard and bright ANSI SGR codes
+    ANSI_COLOR_MAP = {
+        30: "black", 31: "red3", 32: "green4", 33: "gold3",
+        34: "blue2", 35: "magenta3", 36: "cyan4", 37: "gray60",
+        90: "gray40", 91: "red", 92: "green3", 93: "gold",
+        94: "royal blue", 95: "magenta", 96: "cyan3", 97: "gray85",
+    }
+
+    # Oldest output is trimmed beyond this many lines so the Text widget
+    # does not grow without bound over a long session
+    MAX_OUTPUT_LINES = 5000
+    # Lines removed beyond the limit, so the trim runs once per this many
+    # lines of output instead of on every flush once the limit is reached
+    TRIM_LINES = 1000
+
+    # Telnet command bytes (RFC 854)
+    IAC = 0xFF
+    DONT = 0xFE
+    DO = 0xFD
+    WONT = 0xFC
+    WILL = 0xFB
+    SB = 0xFA
+    SE = 0xF0
+    # Commands followed by a single option byte
+    NEGOTIATION_COMMANDS = frozenset((WILL, WONT, DO, DONT))
+    # Generic MUD Communication Protocol option
+    GMCP = 0xC9
+    # Answer to the server's IAC WILL GMCP
+    _RESP_DO_GMCP = bytes((IAC, DO, GMCP))
+    # A subnegotiation still unterminated past this size is dropped, so a
+    # server that never sends IAC SE cannot grow the receive buffer forever
+    MAX_SUBNEGOTIATION = 1 << 20
+    # Telnet end of line, appended to every command sent
+    EOL = b"\r\n"
+    # While connected, the Tk thread checks for network work once per
+    # frame (~60 Hz)
+    DRAIN_INTERVAL_MS = 16
+
     def __init__(self, root):
         self.root = root
         self.root.title("MUD Client")
         self.profile_manager = ProfileManager()
+        self.profile_manager.subscribe(self.on_profile_changed)
+
+        # (text, tag) pairs waiting to be written to the output widget
+        self._pending_segments = []
+        # (kind, value) items from the network thread for the Tk thread
+        self._inq = queue.SimpleQueue()
+        self._drain_running = False
+
+        # GMCP package name -> listeners, looked up once per frame;
+        # listeners registered without packages receive every frame
+        self._gmcp_package_listeners = {}
+        self._gmcp_wildcard = ()
+        self._gmcp_dispatch = {}
+        self.register_gmcp_listener(self._on_char_vitals, ["Char.Vitals"])
+
+        # Reused for every read instead of allocating a new bytes per recv()
+        self._recv_buf = bytearray(65536)
+        self._recv_view = memoryview(self._recv_buf)
+
+        # One network thread waits on every socket through a selector; the
+        # socket pair lets the GUI thread wake it after (un)registering
+        self.sock = None
+        self._selector = selectors.DefaultSelector()
+        self._wakeup_recv, self._wakeup_send = socket.socketpair()
+        self._selector.register(self._wakeup_recv, selectors.EVENT_READ)
+        self.network_thread = threading.Thread(target=self._network_loop, daemon=True)
+        self.network_thread.start()
 
         self.setup_gui()
 
@@ -36,15 +134,60 @@ class MUDClientApp:
 
         self.output_text = tk.Text(self.root, state=tk.DISABLED)
         self.output_text.pack(fill=tk.BOTH, expand=True)
+        self._output_text_insert = self.output_text.insert
+        self.define_text_tags()
 
         self.input_entry = tk.Entry(self.root)
         self.input_entry.pack(fill=tk.X, expand=True)
         self.input_entry.bind("<Return>", self.send_message)
 
+    def define_text_tags(self):
+        # Table indexed directly by SGR code so the parser does one list
+        # index per code; codes that do not change the color stay None.
+        # Reset (0) and default color (39) use the unconfigured "default" tag
+        self._ansi_tag_by_code = [None] * 128
+        self._ansi_tag_by_code[0] = self._ansi_tag_by_code[39] = "default"
+        for code, color in self.ANSI_COLOR_MAP.items():
+            tag = f"ansi_{code}"
+            self.output_text.tag_config(tag, foreground=color)
+            self._ansi_tag_by_code[code] = tag
+        # Servers repeat the same few parameter strings ("0", "1;31",
+        # "0;37"...), so resolve each one once
+        self._sgr_tag = lru_cache(maxsize=256)(self._resolve_sgr)
+
+    def _resolve_sgr(self, params):
+        # Tag selected by an SGR parameter string such as "1;31", or None
+        # if none of its codes change the color; an empty parameter is 0
+        tag_by_code = self._ansi_tag_by_code
+        result = None
+        codes = params.split(";")
+        count = len(codes)
+        i = 0
+        while i < count:
+            param = codes[i]
+            i += 1
+            if len(param) > 3 or param and not param.isdigit():
+                # Above the table (also keeps int() bounded), or a
+                # private/sub-parameter form such as "?1" or "38:5:1"
+                continue
+            code = int(param) if param else 0
+            if code in (38, 48, 58):
+                # Extended color; its arguments (5;n or 2;r;g;b) are not
+                # SGR codes and must not be looked up as such
+                mode = codes[i] if i < count else ""
+                i += 2 if mode == "5" else 4 if mode == "2" else 1
+            elif code < 128 and tag_by_code[code] is not None:
+                result = tag_by_code[code]
+        return result
+
     def load_profiles(self):
         self.profile_listbox.delete(0, tk.END)
-        for profile_name in self.profile_manager.profiles:
-            self.profile_listbox.insert(tk.END, profile_name)
+        # One Tk call for all rows instead of one per profile
+        names = list(self.profile_manager.profiles)
+        if names:
+            self.profile_listbox.insert(tk.END, *names)
+        # Profile name -> listbox row, so a change touches only its row
+        self._profile_rows = {name: row for row, name in enumerate(names)}
 
     def add_profile(self):
         name = simpledialog.askstring("Profile Name", "Enter profile name:")
@@ -53,13 +196,26 @@ class MUDClientApp:
 
         if name and host and port:
             self.profile_manager.add_profile(name, host, port)
-            self.load_profiles()
 
     def remove_profile(self):
         selected_profile = self.profile_listbox.get(tk.ACTIVE)
         if selected_profile:
             self.profile_manager.remove_profile(selected_profile)
-            self.load_profiles()
+
+    def on_profile_changed(self, name, old_profile, new_profile):
+        # Only the name is shown, so an edited profile keeps its row
+        rows = self._profile_rows
+        if old_profile is None:
+            rows[name] = len(rows)
+            self.profile_listbox.insert(tk.END, name)
+        elif new_profile is None:
+            row = rows.pop(name, None)
+            if row is not None:
+                self.profile_listbox.delete(row)
+                # Rows below the removed one move up; no Tk calls needed
+                for other, other_row in rows.items():
+                    if other_row > row:
+                        rows[other] = other_row - 1
 
     def create_hud(self):
         self.hud_frame = tk.Frame(self.root, bg="gray")
@@ -80,12 +236,99 @@ class MUDClientApp:
     def update_health(self, health):
         self.health_label.config(text=f"Health: {health}")
 
+    def register_gmcp_listener(self, callback, packages=None):
+        # callback(package, data) runs on the Tk thread
+        if packages is None:
+            self._gmcp_wildcard += (callback,)
+        else:
+            by_package = self._gmcp_package_listeners
+            for package in packages:
+                by_package[package] = by_package.get(package, ()) + (callback,)
+        # Each package's listeners are combined with the wildcard ones here,
+        # where it is rare, so dispatch iterates one prebuilt immutable tuple
+        # that a listener cannot change
+        wildcard = self._gmcp_wildcard
+        self._gmcp_dispatch = {
+            package: listeners + wildcard
+            for package, listeners in self._gmcp_package_listeners.items()
+        }
+
+    def handle_gmcp(self, package, data):
+        for listener in self._gmcp_dispatch.get(package, self._gmcp_wildcard):
+            try:
+                listener(package, data)
+            except Exception as e:
+                name = getattr(listener, "__name__", listener)
+                print(f"Error in GMCP listener {name} for {package}: {e}")
+
+    def _on_char_vitals(self, package, data):
+        if isinstance(data, dict) and "hp" in data:
+            self.update_health(data["hp"])
+
     def display_message(self, message, color=None):
+        # Local messages do not wait for the drain timer, which only runs
+        # while connected; one idle flush covers a burst of them
+        if not self._pending_segments:
+            self.root.after_idle(self._flush_output)
+        self._pending_segments.append((message + "\n", color or ""))
+
+    def _post(self, kind, sock, value):
+        # Called from the network thread, which never touches Tk itself;
+        # the Tk thread's own timer picks the item up
+        self._inq.put((kind, sock, value))
+
+    def _start_drain(self):
+        if not self._drain_running:
+            self._drain_running = True
+            self.root.after(self.DRAIN_INTERVAL_MS, self._drain_queue)
+
+    def _drain_queue(self):
+        # A burst of network work becomes one Tk callback and one widget
+        # update per frame
+        get = self._inq.get_nowait
+        try:
+            while True:
+                kind, sock, value = get()
+                if sock is not self.sock:
+                    # Left over from a connection that was since replaced
+                    continue
+                if kind == "spans":
+                    self._pending_segments.extend(value)
+                elif kind == "gmcp":
+                    for package, data in value:
+                        self.handle_gmcp(package, data)
+                elif kind == "closed":
+                    self.disconnect()
+        except queue.Empty:
+            pass
+        finally:
+            # Rescheduled even if a handler raised. Once disconnected and
+            # drained the timer stops, so a client without a connection
+            # costs no wakeups; connect() starts it again
+            if self.sock is None and self._inq.empty():
+                self._drain_running = False
+            else:
+                self.root.after(self.DRAIN_INTERVAL_MS, self._drain_queue)
+        self._flush_output()
+
+    def _flush_output(self):
+        pending, self._pending_segments = self._pending_segments, []
+        if not pending:
+            return
+
+        # Only follow the tail if the user has not scrolled back to read
+        at_bottom = self.output_text.yview()[1] >= 0.999
+        # Text.insert takes alternating chars/tagList arguments, so every
+        # segment goes in with a single Tk call
         self.output_text.config(state=tk.NORMAL)
-        self.output_text.insert(tk.END, message, color)
-        self.output_text.insert(tk.END, "\n")
+        self._output_text_insert(tk.END, *chain.from_iterable(pending))
+        line_count = int(self.output_text.index('end-1c').split('.')[0])
+        if line_count > self.MAX_OUTPUT_LINES:
+            keep = self.MAX_OUTPUT_LINES - self.TRIM_LINES
+            self.output_text.delete('1.0', f'{line_count - keep + 1}.0')
         self.output_text.config(state=tk.DISABLED)
-        self.output_text.yview(tk.END)
+        if at_bottom:
+            self.output_text.yview(tk.END)
 
     def connect_to_profile(self):
         selected_profile = self.profile_listbox.get(tk.ACTIVE)
@@ -94,55 +337,265 @@ class MUDClientApp:
             self.connect(profile['host'], profile['port'])
 
     def connect(self, host, port):
-        self.sock = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
-        self.sock.connect((host, port))
+        self.disconnect()
+        sock = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+        # Send each command immediately instead of letting Nagle hold it
+        # for an ACK, and give bursts of output a bigger kernel buffer (set
+        # before connecting so the receive window is sized to match)
+        sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+        sock.setsockopt(socket.SOL_SOCKET, socket.SO_RCVBUF, 1 << 20)
+        try:
+            sock.connect((host, port))
+        except OSError as e:
+            sock.close()
+            messagebox.showerror("Connection Error", f"Could not connect to {host}:{port}: {e}")
+            return
+
+        self.sock = sock
+        self._selector.register(sock, selectors.EVENT_READ, data=_ConnectionState())
+        self._wakeup_send.send(b"\0")
+        self._start_drain()
         self.update_connection_status(True)
-        self.receive_thread = threading.Thread(target=self.receive_messages)
-        self.receive_thread.start()
 
-    def receive_messages(self):
+    def disconnect(self):
+        sock, self.sock = self.sock, None
+        if sock is None:
+            return
+        try:
+            self._selector.unregister(sock)
+        except (KeyError, ValueError):
+            pass  # Already unregistered by the network thread
+        self._wakeup_send.send(b"\0")
+        sock.close()
+        self.update_connection_status(False)
+
+    def _network_loop(self):
         while True:
             try:
-                message = self.sock.recv(1024).decode('utf-8')
-                if message:
-                    self.parse_and_display_message(message)
-                    # Example: Simulate GMCP health message
-                    if "GMCP" in message:
-                        gmcp_data = message.split("GMCP ")[1]
-                        if "Char.Vitals" in gmcp_data:
-                            health_data = gmcp_data.split("Char.Vitals ")[1]
-                            health = health_data.split(",")[0]
-                            self.update_health(health)
-            except:
-                break
-
-    def parse_and_display_message(self, message):
-        # Regular expression to match ANSI escape codes for text color
-        color_pattern = re.compile(r'\x1b\[(\d+)(;\d+)?m')
-
-        # Split the message based on ANSI escape codes
-        parts = color_pattern.split(message)
-
-        # Start with default color
-        current_color = "black"
-
-        # Iterate over message parts and display them with appropriate color
-        for part in parts:
-            if part.startswith("\x1b["):
-                # This part contains color information
-                color_code = int(part[2:-1])  # Extract color code
-                if color_code == 0:  # Reset color
-                    current_color = "black"
-                elif color_code == 31:  # Red color
-                    current_color = "red"
-                elif color_code == 32:  # Green color
-                    current_color = "green"
-                # Add more color codes as needed
+                events = self._selector.select()
+            except OSError:
+                continue  # A socket was closed while we were waiting
+            for key, _ in events:
+                if key.fileobj is self._wakeup_recv:
+                    self._wakeup_recv.recv(512)
+                elif key.fileobj is self.sock:
+                    try:
+                        self._on_readable(key)
+                    except Exception as e:
+                        # Bad input must not kill the only network thread;
+                        # drop this connection and keep serving the next one
+                        print(f"Error reading from server: {e}")
+                        self._drop_socket(key.fileobj)
+
+    def _drop_socket(self, sock):
+        # Stop watching it right away so select() does not keep reporting
+        # it before disconnect() runs on the Tk thread
+        try:
+            self._selector.unregister(sock)
+        except (KeyError, ValueError):
+            pass
+        self._post("closed", sock, None)
+
+    def _on_readable(self, key):
+        sock = key.fileobj
+        state = key.data
+        try:
+            count = sock.recv_into(self._recv_view)
+        except OSError:
+            count = 0
+        if not count:
+            # Closed by the server
+            self._drop_socket(sock)
+            return
+
+        rx_buffer = state.rx_buffer
+        rx_buffer += self._recv_view[:count]
+        gmcp_frames = []
+        replies = bytearray()
+        text, remainder = self._strip_telnet(state, rx_buffer, gmcp_frames, replies)
+        # Telnet sends CR LF for a newline and CR NUL for a bare CR
+        # (RFC 854); the Text widget only wants the LF
+        text = text.translate(None, b"\r\0")
+        if text.isascii() and not state.decoder.getstate()[0]:
+            # Most MUD output is plain ASCII; skip the incremental decoder
+            # unless it is holding part of a multi-byte character
+            message = text.decode('ascii')
+        else:
+            message = state.decoder.decode(text)
+        rx_buffer[:] = remainder
+
+        if replies:
+            try:
+                sock.sendall(replies)
+            except OSError:
+                pass  # The read side will notice the closed connection
+        # GMCP JSON is decoded here so the Tk thread only gets finished
+        # data, one batch per read
+        if gmcp_frames:
+            self._post("gmcp", sock, [self._decode_gmcp(frame) for frame in gmcp_frames])
+        if message:
+            # Parsed here so the Tk thread only inserts ready (text, tag) runs
+            self._post("spans", sock, self.parse_ansi_message(state, message))
+
+    def _decode_gmcp(self, frame):
+        # "Package.Name <json>"; the JSON body is optional. Both JSON
+        # decoders take bytes, so the body is never decoded separately
+        package, _, body = frame.partition(b" ")
+        data = None
+        if body:
+            try:
+                data = json_loads(body)
+            except (ValueError, RecursionError):
+                # Not JSON, or nested deeper than the decoder can handle
+                data = body.decode('utf-8', errors='replace')
+        return package.decode('utf-8', errors='replace'), data
+
+    def _strip_telnet(self, state, data, gmcp_frames, replies):
+        # Returns (text, remainder); remainder is an incomplete telnet
+        # command at the end of data, to be completed by the next chunk.
+        # GMCP subnegotiation payloads are appended to gmcp_frames and any
+        # negotiation answers to replies.
+        if state.skipping_sb:
+            # Discarding an oversized subnegotiation up to its IAC SE
+            end = self._find_se(data, 0)
+            if end < 0:
+                return b"", self._trailing_iac(data, 0)
+            state.skipping_sb = False
+            data = data[end + 2:]
+        # Most chunks carry no telnet commands, so skip the scan entirely
+        iac = data.find(b'\xff')
+        if iac < 0:
+            return data, b""
+
+        # Copy the runs between IAC sequences; find() does the searching
+        # so only the commands themselves are handled in Python
+        find = data.find
+        length = len(data)
+        text = bytearray()
+        pos = 0
+        while iac >= 0:
+            text += data[pos:iac]
+            if iac + 1 == length:
+                return text, data[iac:]
+            command = data[iac + 1]
+            if command == self.IAC:
+                # Escaped 0xFF data byte
+                text.append(self.IAC)
+                pos = iac + 2
+            elif command in self.NEGOTIATION_COMMANDS:
+                if iac + 2 == length:
+                    return text, data[iac:]
+                if command == self.WILL and data[iac + 2] == self.GMCP:
+                    # Accept the server's offer so it starts sending GMCP
+                    replies += self._RESP_DO_GMCP
+                pos = iac + 3
+            elif command == self.SB:
+                end = self._find_se(data, iac + 2)
+                if end < 0:
+                    if length - iac > self.MAX_SUBNEGOTIATION:
+                        print(f"Dropping unterminated subnegotiation over {self.MAX_SUBNEGOTIATION} bytes")
+                        state.skipping_sb = True
+                        return text, self._trailing_iac(data, iac + 2)
+                    return text, data[iac:]
+                if iac + 2 < end and data[iac + 2] == self.GMCP:
+                    gmcp_frames.append(bytes(data[iac + 3:end]).replace(b'\xff\xff', b'\xff'))
+                pos = end + 2
+            else:
+                pos = iac + 2
+            iac = find(b'\xff', pos)
+        text += data[pos:]
+        return text, b""
+
+    @staticmethod
+    def _odd_iac_run(data, start, end):
+        # True if data[start:end] ends in an odd run of 0xFF bytes, i.e.
+        # its last 0xFF is an IAC rather than half of an escaped IAC IAC
+        run = end
+        while run > start and data[run - 1] == 0xFF:
+            run -= 1
+        return (end - run) % 2 == 1
+
+    @classmethod
+    def _find_se(cls, data, start):
+        # Index of the IAC SE ending a subnegotiation payload that starts
+        # at start, or -1. An escaped 0xFF data byte followed by 0xF0 is
+        # not IAC SE; it shows up as an odd run of 0xFF before the match
+        end = data.find(b'\xff\xf0', start)
+        while end >= 0 and cls._odd_iac_run(data, start, end):
+            end = data.find(b'\xff\xf0', end + 1)
+        return end
+
+    @classmethod
+    def _trailing_iac(cls, data, start):
+        # Carried over while discarding a subnegotiation: a trailing IAC
+        # may be completed to IAC SE by the next chunk
+        return b'\xff' if cls._odd_iac_run(data, start, len(data)) else b""
+
+    def parse_ansi_message(self, state, message):
+        if state.ansi_partial:
+            message = state.ansi_partial + message
+            state.ansi_partial = ""
+        elif "\x1b" not in message:
+            # Plain text, the common case: one run in the current color
+            return [(message, state.cur_tag)]
+        return list(self._iter_ansi_spans(state, message))
+
+    def _iter_ansi_spans(self, state, message):
+        # Yields (text, color) runs, consuming ANSI CSI sequences as it goes
+        find = message.find
+        sgr_tag = self._sgr_tag
+        length = len(message)
+        pos = 0
+        while True:
+            start = find("\x1b[", pos)
+            if start < 0:
+                if message.endswith("\x1b"):
+                    # A lone ESC may be the start of a split sequence
+                    state.ansi_partial = "\x1b"
+                    length -= 1
+                if pos < length:
+                    yield message[pos:length], state.cur_tag
+                return
+            if start > pos:
+                yield message[pos:start], state.cur_tag
+
+            # ECMA-48: parameter bytes 0x30-0x3F, then intermediate bytes
+            # 0x20-0x2F, then a final byte 0x40-0x7E
+            end = start + 2
+            while end < length and "0" <= message[end] <= "?":
+                end += 1
+            params_end = end
+            while end < length and " " <= message[end] <= "/":
+                end += 1
+            if end == length:
+                # Truncated sequence; finish it with the next message
+                state.ansi_partial = message[start:]
+                return
+
+            final = message[end]
+            if final == "m" and end == params_end:
+                # Select Graphic Rendition
+                tag = sgr_tag(message[start + 2:end])
+                if tag is not None:
+                    state.cur_tag = tag
+            if "@" <= final <= "~":
+                pos = end + 1
             else:
-                # Regular text, display with current color
-                self.display_message(part, color=current_color)
+                # Malformed; drop the sequence but keep the character
+                pos = end
 
     def send_message(self, event):
+        if self.sock is None:
+            return
         message = self.input_entry.get()
-        self.sock.send(message.encode('utf-8'))
-        self.input_entry.delete(0, tk.END)
+        # An empty line is still sent: MUDs use a bare Enter to page text
+        # and redraw the prompt
+        try:
+            self.sock.sendall(message.encode('utf-8') + self.EOL)
+        except OSError as e:
+            # The server went away before its close reached the drain
+            print(f"Error sending to server: {e}")
+            self.disconnect()
+            return
+        if message:
+            self.input_entry.delete(0, tk.END)
@@ -1,11 +1,17 @@
 import json
 import os
+import stat
+import tempfile
 from pathlib import Path
 
 class ProfileManager:
     def __init__(self, filename="profiles.json"):
         # Save the profiles file in the user's home directory
         self.filename = os.path.join(Path.home(), filename)
+        self._last_saved = None
+        # A tuple rebuilt on (un)subscribe, so a callback that unsubscribes
+        # during a notification cannot make the next one be skipped
+        self._listeners = ()
         self.profiles = self.load_profiles()
 
     def load_profiles(self):
@@ -18,17 +24,56 @@ class ProfileManager:
         return {}
 
     def save_profiles(self):
+        data = json.dumps(self.profiles, indent=4)
+        if data == self._last_saved:
+            return
+
+        # Write to a temporary file and swap it in, so a failed write never
+        # truncates the existing profiles. A symlinked profiles file is
+        # replaced at its target, so the link itself is kept
+        target = os.path.realpath(self.filename)
+        tmp_name = None
         try:
-            with open(self.filename, 'w') as file:
-                json.dump(self.profiles, file, indent=4)
+            with tempfile.NamedTemporaryFile('w', dir=os.path.dirname(target),
+                                             suffix=".tmp", delete=False) as file:
+                tmp_name = file.name
+                file.write(data)
+            # The temporary file is created 0600; keep the permissions the
+            # user had on the existing file
+            try:
+                os.chmod(tmp_name, stat.S_IMODE(os.stat(target).st_mode))
+            except FileNotFoundError:
+                pass
+            os.replace(tmp_name, target)
+            self._last_saved = data
         except Exception as e:
             print(f"Error saving profiles: {e}")
+            if tmp_name and os.path.exists(tmp_name):
+                os.remove(tmp_name)
+
+    def subscribe(self, callback):
+        # callback(name, old_profile, new_profile); old is None for a new
+        # profile and new is None for a removed one
+        self._listeners += (callback,)
+
+    def unsubscribe(self, callback):
+        if callback in self._listeners:
+            listeners = list(self._listeners)
+            listeners.remove(callback)
+            self._listeners = tuple(listeners)
+
+    def _notify(self, name, old_profile, new_profile):
+        for callback in self._listeners:
+            callback(name, old_profile, new_profile)
 
     def add_profile(self, name, host, port):
+        old_profile = self.profiles.get(name)
         self.profiles[name] = {'host': host, 'port': port}
         self.save_profiles()
+        self._notify(name, old_profile, self.profiles[name])
 
     def remove_profile(self, name):
         if name in self.profiles:
-            del self.profiles[name]
+            old_profile = self.profiles.pop(name)
             self.save_profiles()
+            self._notify(name, old_profile, None)